@@ -38,7 +38,6 @@ import tensorflow_datasets as tfds
 _DEFAULT_FEATURE_KEYS = ["inputs", "targets"]
 
 _VALID_TASK_NAME_REGEX = re.compile(r"^[\w\d\._]+$")
-_MAX_EXAMPLES_TO_MEM_CACHE = 10000
 SHUFFLE_BUFFER_SIZE = 1000
 
 
@@ -304,10 +303,12 @@ class TfdsDataSource(DataSource):
       seed: Optional[int] = None,
       shard: Optional[str] = None
   ) -> tf.data.Dataset:
+    # `Task.get_dataset` prefetches after preprocessing, so skip it here.
     if shard:
       return self.tfds_dataset.load_shard(
-          shard, shuffle_files=shuffle, seed=seed)
-    return self.tfds_dataset.load(split, shuffle_files=shuffle, seed=seed)
+          shard, shuffle_files=shuffle, seed=seed, prefetch_buffer=None)
+    return self.tfds_dataset.load(
+        split, shuffle_files=shuffle, seed=seed, prefetch_buffer=None)
 
   def num_input_examples(self, split: str) -> int:
     """Overrides since we can't call `info.splits` until after init."""
@@ -447,15 +448,16 @@ class TFExampleDataSource(FileDataSource):
 
 
 def print_dataset(dataset):
-  """tf.Print dataset fields for debugging purposes."""
+  """tf.print dataset fields for debugging purposes."""
   def my_fn(x):
-    return {k: tf.print(v, [v], k + ": ") for k, v in x.items()}
+    tf.print(x)
+    return x
   return dataset.map(my_fn)
 
 
 @gin.configurable
 def maybe_print_dataset(dataset, should_print=False):
-  """tf.Print dataset for debugging purposes."""
+  """tf.print dataset for debugging purposes."""
   return print_dataset(dataset) if should_print else dataset
 
 
@@ -806,7 +808,7 @@ class TaskV3(DatasetProviderBase):
     ds = ds.prefetch(tf.data.experimental.AUTOTUNE)
 
     if (not use_cached and self.num_input_examples(split) and
-        self.num_input_examples(split) < _MAX_EXAMPLES_TO_MEM_CACHE):
+        self.num_input_examples(split) < utils.MAX_EXAMPLES_TO_MEM_CACHE):
       ds = ds.cache()
 
    # Post tokenization processing.
@@ -842,9 +844,8 @@ class TaskV3(DatasetProviderBase):
         for feat, desc in split_info["features"].items()}
 
     ds = tf.data.Dataset.list_files(
-        "%s-*-of-*%d" % (
-            utils.get_tfrecord_prefix(self.cache_dir, split),
-            split_info["num_shards"]),
+        utils.get_tfrecord_sharded_pattern(
+            self.cache_dir, split, split_info["num_shards"]),
         shuffle=shuffle,
         seed=seed)
     ds = ds.interleave(
@@ -853,7 +854,8 @@ class TaskV3(DatasetProviderBase):
         num_parallel_calls=tf.data.experimental.AUTOTUNE)
     ds = ds.map(lambda ex: tf.io.parse_single_example(ex, feature_desc),
                 num_parallel_calls=tf.data.experimental.AUTOTUNE)
-    if self.get_cached_stats(split)["examples"] <= _MAX_EXAMPLES_TO_MEM_CACHE:
+    if (self.get_cached_stats(split)["examples"] <=
+        utils.MAX_EXAMPLES_TO_MEM_CACHE):
       ds = ds.cache()
     return ds
 
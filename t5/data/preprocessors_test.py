@@ -58,6 +58,8 @@ class PreprocessorsTest(tf.test.TestCase):
       self.assertTrue(self.evaluate(first))
       self.assertFalse(self.evaluate(last))
 
+  # The expected outputs were generated with the argsort-based shuffle.
+  @mock.patch.object(utils, '_HAS_NATIVE_STATELESS_SHUFFLE', False)
   def test_random_spans_noise_mask(self):
     length = 32
     noise_density = 0.25
@@ -125,6 +127,8 @@ class PreprocessorsTest(tf.test.TestCase):
         tokens, noise_mask, vocabulary, ()))
     self.assertAllEqual(output, expected_output)
 
+  # The expected outputs were generated with the argsort-based shuffle.
+  @mock.patch.object(utils, '_HAS_NATIVE_STATELESS_SHUFFLE', False)
   def test_permute_noise_tokens(self):
     tf.random.set_seed(55)
     vocabulary = test_utils.MockVocabulary({'foo': [10]}, vocab_size=1000)
@@ -1118,6 +1122,8 @@ class PreprocessorsTest(tf.test.TestCase):
             'suffix': [2, 3]
         })
 
+  # The expected outputs were generated with the argsort-based shuffle.
+  @mock.patch.object(utils, '_HAS_NATIVE_STATELESS_SHUFFLE', False)
   def test_denoise(self):
     vocab = test_utils.sentencepiece_vocab()
     target_tokens = vocab.encode('The quick brown fox.')
@@ -1147,15 +1153,51 @@ class PreprocessorsTest(tf.test.TestCase):
           inputs_fn=prep.noise_span_to_unique_sentinel,
           targets_fn=prep.nonnoise_span_to_unique_sentinel)
 
-    # Two spans corrupted, [2] and [22, 3, 2, 7, 2], replaced by unique
+    # Two spans corrupted, [2, 20, 4, 3] and [7, 2], replaced by unique
     # sentinels 25 and 24 respectively.
     assert_dataset(denoised_dataset, [
         {
             'inputs': [
-                3, 2, 20, 4, 25, 2, 8, 13, 2, 3, 2, 23, 7, 19, 24
+                3, 25, 2, 8, 13, 2, 3, 2, 23, 7, 19, 22, 3, 2, 24
             ],
             'targets': [
-                25, 3, 24, 22, 3, 2, 7, 2
+                25, 2, 20, 4, 3, 24, 7, 2
+            ],
+        },
+    ])
+
+  @absltest.skipIf(not utils._HAS_NATIVE_STATELESS_SHUFFLE,
+                   'Requires tf.random.experimental.stateless_shuffle.')
+  def test_denoise_native_shuffle(self):
+    vocab = test_utils.sentencepiece_vocab()
+    target_tokens = vocab.encode('The quick brown fox.')
+    og_dataset = tf.data.Dataset.from_tensor_slices({
+        'targets': [target_tokens],
+    })
+    output_features = {
+        'targets': Feature(vocab),
+    }
+
+    # Same as `test_denoise`, but with the native shuffle kernel, which
+    # produces different permutations than the argsort-based shuffle.
+    with utils.map_seed_manager(42):
+      denoised_dataset = prep.denoise(
+          og_dataset,
+          output_features,
+          noise_density=0.3,
+          noise_mask_fn=prep.random_spans_noise_mask,
+          inputs_fn=prep.noise_span_to_unique_sentinel,
+          targets_fn=prep.nonnoise_span_to_unique_sentinel)
+
+    # Two spans corrupted, [3, 2, 23, 7, 19] and [2], replaced by unique
+    # sentinels 25 and 24 respectively.
+    assert_dataset(denoised_dataset, [
+        {
+            'inputs': [
+                3, 2, 20, 4, 3, 2, 8, 13, 2, 25, 22, 3, 2, 7, 24
+            ],
+            'targets': [
+                25, 3, 2, 23, 7, 19, 24, 2
             ],
         },
     ])
@@ -324,10 +324,12 @@ def assert_datasets_neq(dataset1, dataset2):
                              assert_datasets_eq, dataset1, dataset2)
 
 
-def get_fake_dataset(split, shuffle_files=False, seed=None):
+def get_fake_dataset(split, shuffle_files=False, seed=None,
+                     prefetch_buffer=None):
   """Returns a tf.data.Dataset with fake data."""
   del shuffle_files  # Unused, to be compatible with TFDS API.
   del seed
+  del prefetch_buffer
 
   output_types = {"prefix": tf.string, "suffix": tf.string}
   if split == "validation":
@@ -528,9 +530,11 @@ class FakeTaskTest(absltest.TestCase):
                 "take": -1
             }],
     }
-    def _load_shard(shard_instruction, shuffle_files, seed):
+    def _load_shard(shard_instruction, shuffle_files, seed,
+                    prefetch_buffer=None):
       del shuffle_files
       del seed
+      del prefetch_buffer
       fname = shard_instruction["filename"]
       if "train" in fname:
         if fname.endswith("00000-of-00002"):
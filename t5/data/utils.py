@@ -30,13 +30,34 @@ import tensorflow_datasets as tfds
 _INFO_FILENAME = "info.{split}.json"
 _STATS_FILENAME = "stats.{split}.json"
 _TFRECORD_PREFIX = "{split}.tfrecord"
+# Appended to the TFRecord prefix, like Beam's default shard name template.
+_TFRECORD_SHARD_SUFFIX = "-{shard}-of-{num_shards:05d}"
+
+# `tf.data.AUTOTUNE` is only available in TF >= 2.4.
+_AUTOTUNE = getattr(tf.data, "AUTOTUNE", tf.data.experimental.AUTOTUNE)
+
+# Bound once to avoid resolving the attributes for every feature of every
+# example in `dict_to_tfexample`.
+_Example = tf.train.Example
+_Features = tf.train.Features
+_Feature = tf.train.Feature
+_BytesList = tf.train.BytesList
+_FloatList = tf.train.FloatList
+_Int64List = tf.train.Int64List
 
 _TFDS_DATA_DIR_OVERRIDE = None
 _GLOBAL_CACHE_DIRECTORIES = []
 
+# `tf.random.experimental.stateless_shuffle` is only in newer TF versions.
+_HAS_NATIVE_STATELESS_SHUFFLE = hasattr(
+    tf.random.experimental, "stateless_shuffle")
+
 DEFAULT_SPM_PATH = "gs://t5-data/vocabs/cc_all.32000/sentencepiece.model"  # GCS
 DEFAULT_EXTRA_IDS = 100
 
+# Splits with more examples than this should be cached to files, not memory.
+MAX_EXAMPLES_TO_MEM_CACHE = 10000
+
 
 def get_default_vocabulary():
   return sentencepiece_vocabulary.SentencePieceVocabulary(
@@ -64,6 +85,12 @@ def add_global_cache_dirs(global_cache_dirs):
   _GLOBAL_CACHE_DIRECTORIES += global_cache_dirs
 
 
+@functools.lru_cache(maxsize=None)
+def _get_builder(name, data_dir):
+  """Returns the memoized TFDS builder for the dataset name and data dir."""
+  return tfds.builder(name, data_dir=data_dir)
+
+
 class LazyTfdsLoader(object):
   """Wrapper for TFDS datasets with memoization and additional functionality.
 
@@ -71,8 +98,6 @@ class LazyTfdsLoader(object):
   file operations. Also provides additional utility methods.
   """
 
-  _MEMOIZED_BUILDERS = {}
-
   def __init__(self, name, data_dir=None, split_map=None):
     """LazyTfdsLoader constructor.
 
@@ -86,6 +111,8 @@ class LazyTfdsLoader(object):
     self._name = name
     self._data_dir = data_dir
     self._split_map = split_map
+    self._files_cache = {}
+    self._size_cache = {}
 
   @property
   def name(self):
@@ -103,11 +130,7 @@ class LazyTfdsLoader(object):
 
   @property
   def builder(self):
-    builder_key = (self.name, self.data_dir)
-    if builder_key not in LazyTfdsLoader._MEMOIZED_BUILDERS:
-      LazyTfdsLoader._MEMOIZED_BUILDERS[builder_key] = tfds.builder(
-          self.name, data_dir=self.data_dir)
-    return LazyTfdsLoader._MEMOIZED_BUILDERS[builder_key]
+    return _get_builder(self.name, self.data_dir)
 
   @property
   def info(self):
@@ -119,6 +142,8 @@ class LazyTfdsLoader(object):
   def files(self, split):
     """Returns set of instructions for reading TFDS files for the dataset."""
     split = self._map_split(split)
+    if split in self._files_cache:
+      return self._files_cache[split]
 
     if "/" not in self.name and self.builder.BUILDER_CONFIGS:
       # If builder has multiple configs, and no particular config was
@@ -130,12 +155,40 @@ class LazyTfdsLoader(object):
 
     if not files:
       logging.fatal("No TFRecord files found for dataset: %s", self.name)
+    self._files_cache[split] = files
     return files
 
-  def load(self, split, shuffle_files, seed=None):
-    """Returns a tf.data.Dataset for the given split."""
+  def load(self, split, shuffle_files, seed=None, cache=None,
+           prefetch_buffer=_AUTOTUNE):
+    """Returns a tf.data.Dataset for the given split.
+
+    Args:
+      split: str, the canonical split to load.
+      shuffle_files: bool, whether to shuffle the input files.
+      seed: int (optional), the seed for shuffling the files.
+      cache: bool or str (optional), whether to cache the loaded examples so
+        they are only read once across epochs. If True, caches in memory, which
+        should only be used for small splits since large ones will run out of
+        memory. If a str, caches to files with that path prefix instead, which
+        works for splits of any size. Since the cache stores the examples in
+        the order of the first epoch, later epochs are not reshuffled when
+        `shuffle_files` is also set.
+      prefetch_buffer: int (optional), the number of elements to prefetch, or
+        None to disable prefetching. Defaults to AUTOTUNE.
+    Returns:
+      A tf.data.Dataset.
+    """
+    if cache is True and self.size(split) > MAX_EXAMPLES_TO_MEM_CACHE:
+      logging.warning(
+          "Caching split '%s' of dataset '%s' with %s examples in memory may "
+          "run out of memory. Consider passing a file path for `cache`.",
+          split, self.name, self.size(split))
+    if cache and shuffle_files:
+      logging.warning(
+          "Caching split '%s' of dataset '%s' freezes the shuffled file order "
+          "of the first epoch for all later epochs.", split, self.name)
     split = self._map_split(split)
-    return tfds.load(
+    ds = tfds.load(
         self._name,
         split=split,
         data_dir=self.data_dir,
@@ -147,55 +200,257 @@ class LazyTfdsLoader(object):
             skip_prefetch=True
         )
     )
+    if cache:
+      ds = ds.cache(cache if isinstance(cache, str) else "")
+    if prefetch_buffer is not None:
+      ds = ds.prefetch(prefetch_buffer)
+    return ds
 
-  def load_shard(self, file_instruction, shuffle_files=False, seed=None):
+  def load_shard(self, file_instruction, shuffle_files=False, seed=None,
+                 prefetch_buffer=_AUTOTUNE):
     """Returns a dataset for a single shard of the TFDS TFRecord files."""
     ds = self.builder._tfrecords_reader.read_files(  # pylint:disable=protected-access
         [file_instruction],
-        read_config=tfds.ReadConfig(shuffle_seed=seed),
+        read_config=tfds.ReadConfig(shuffle_seed=seed, skip_prefetch=True),
         shuffle_files=shuffle_files)
+    if prefetch_buffer is not None:
+      ds = ds.prefetch(prefetch_buffer)
+    return ds
+
+  def load_parallel(self, split, shuffle_files=False, seed=None,
+                    cycle_length=16, deterministic=False,
+                    prefetch_buffer=_AUTOTUNE):
+    """Returns a tf.data.Dataset for the split, reading shards in parallel.
+
+    The TFRecord files of the split's file instructions are interleaved,
+    reading from up to `cycle_length` files concurrently, and the examples
+    are decoded with the dataset's features.
+
+    Args:
+      split: str, the canonical split to load.
+      shuffle_files: bool, whether to shuffle the order of the files, which is
+        reshuffled each epoch.
+      seed: int (optional), the seed for shuffling the files.
+      cycle_length: int, the number of files to read from concurrently.
+      deterministic: bool, whether the interleaved output order must be
+        deterministic. Setting to False increases throughput when the order
+        of examples does not matter.
+      prefetch_buffer: int (optional), the number of elements to prefetch, or
+        None to disable prefetching. Defaults to AUTOTUNE.
+    Returns:
+      A tf.data.Dataset.
+    """
+    files = self.files(split)
+    # Older TFDS versions return dicts instead of `FileInstruction`s.
+    get = lambda fi, k: fi[k] if isinstance(fi, dict) else getattr(fi, k)
+    instructions = tf.data.Dataset.from_tensor_slices((
+        [get(fi, "filename") for fi in files],
+        tf.constant([get(fi, "skip") for fi in files], tf.int64),
+        tf.constant([get(fi, "take") for fi in files], tf.int64)))
+    if shuffle_files:
+      instructions = instructions.shuffle(len(files), seed=seed)
+    ds = instructions.interleave(
+        lambda f, skip, take: tf.data.TFRecordDataset(f).skip(skip).take(take),
+        cycle_length=cycle_length,
+        num_parallel_calls=_AUTOTUNE,
+        deterministic=deterministic)
+    ds = ds.map(
+        self.info.features.deserialize_example, num_parallel_calls=_AUTOTUNE)
+    if prefetch_buffer is not None:
+      ds = ds.prefetch(prefetch_buffer)
     return ds
 
   def size(self, split):
     """Returns the number of examples in the split."""
     split = self._map_split(split)
+    if split in self._size_cache:
+      return self._size_cache[split]
+
     ds_splits = self.info.splits
     dataset_size = ds_splits[split].num_examples
     # Very large datasets have num_examples = 0; default instead to np.inf
     dataset_size = dataset_size if dataset_size > 0 else np.inf
+    self._size_cache[split] = dataset_size
     return dataset_size
 
 
-def dict_to_tfexample(ex):
-  """Convert example dictionary to tf.train.Example proto."""
+def dict_to_tfexample(ex, pack_int32_as_bytes=()):
+  """Convert example dictionary to tf.train.Example proto.
+
+  Integer features are normally stored as varint-encoded Int64Lists. Features
+  whose keys are in `pack_int32_as_bytes` are instead stored as a single bytes
+  value containing the raw little-endian int32 array, which is smaller for
+  token sequences and faster to read. These features must be decoded with
+  `decode_packed_int32` and cannot be parsed as int64 features, so readers and
+  writers need to agree on which keys are packed.
+
+  Args:
+    ex: dict, mapping feature keys to scalar or 1-d values.
+    pack_int32_as_bytes: collection of keys of integer features whose values
+      all fit in int32 and should be packed into bytes.
+  Returns:
+    a tf.train.Example proto.
+  """
   feature_dict = {}
   for k, v in ex.items():
-    t = tf.constant(v)
-    if len(t.shape) == 0:  # pylint:disable=g-explicit-length-test
-      v = [v]
-    elif len(t.shape) == 1:
-      v = list(v)
-    else:
+    arr = v if isinstance(v, np.ndarray) else np.asarray(v)
+    is_scalar = arr.ndim == 0
+    if is_scalar:
+      arr = arr.reshape(1)
+    elif arr.ndim != 1:
       raise ValueError(
           "Unsupported shape (%s) for '%s' value: %s" %
-          (t.shape, k, v))
-
-    if t.dtype == tf.string and len(t.shape) <= 1:
-      feature_dict[k] = tf.train.Feature(
-          bytes_list=tf.train.BytesList(
-              value=[tf.compat.as_bytes(t) for t in v]))
-    elif t.dtype in (tf.int32, tf.int64) and len(t.shape) <= 1:
-      feature_dict[k] = tf.train.Feature(
-          int64_list=tf.train.Int64List(value=v))
-    elif t.dtype in (tf.float32, tf.float64) and len(t.shape) <= 1:
-      feature_dict[k] = tf.train.Feature(
-          float_list=tf.train.FloatList(value=v))
+          (arr.shape, k, v))
+
+    if k in pack_int32_as_bytes:
+      # Empty lists are float64 in NumPy, so only check non-empty values.
+      if arr.size and (
+          arr.dtype.kind not in ("i", "u") or
+          arr.min() < np.iinfo(np.int32).min or
+          arr.max() > np.iinfo(np.int32).max):
+        raise ValueError(
+            "Unable to pack '%s' value as int32: %s" % (k, v))
+      feature_dict[k] = _Feature(
+          bytes_list=_BytesList(value=[arr.astype("<i4").tobytes()]))
+    elif arr.dtype.kind in ("S", "U", "O"):
+      if isinstance(v, np.ndarray):
+        source_values = arr.tolist()
+      else:
+        source_values = [v] if is_scalar else list(v)
+      # NumPy converts mixed lists like [1, "a"] to strings, so check that the
+      # original values are all strings.
+      if not all(isinstance(s, (str, bytes)) for s in source_values):
+        raise ValueError(
+            "Unsupported mixed types for '%s' value: %s" % (k, v))
+      # Prefer the original Python values since NumPy strips trailing null
+      # characters from fixed-width strings.
+      values = [s.encode("utf-8") if isinstance(s, str) else s
+                for s in source_values]
+      feature_dict[k] = _Feature(bytes_list=_BytesList(value=values))
+    elif arr.dtype.kind in ("i", "u"):
+      feature_dict[k] = _Feature(int64_list=_Int64List(value=arr.tolist()))
+    elif arr.dtype.kind == "f":
+      feature_dict[k] = _Feature(float_list=_FloatList(value=arr.tolist()))
     else:
       raise ValueError(
           "Unsupported type (%s) and shape (%s) for '%s' value: %s" %
-          (t.dtype, t.shape, k, v))
+          (arr.dtype, arr.shape, k, v))
+
+  return _Example(features=_Features(feature=feature_dict))
+
+
+def decode_packed_int32(packed):
+  """Decodes a feature packed by `dict_to_tfexample` into an int32 Tensor."""
+  return tf.io.decode_raw(packed, tf.int32, little_endian=True)
+
+
+def infer_example_schema(ex):
+  """Infers a `make_example_serializer` schema from an example dictionary."""
+  schema = {}
+  for k, v in ex.items():
+    arr = v if isinstance(v, np.ndarray) else np.asarray(v)
+    if arr.dtype.kind in ("S", "U", "O"):
+      dtype = tf.string
+    elif arr.dtype.kind in ("i", "u"):
+      dtype = tf.int64
+    elif arr.dtype.kind == "f":
+      dtype = tf.float32
+    else:
+      raise ValueError(
+          "Unsupported type (%s) for '%s' value: %s" % (arr.dtype, k, v))
+    schema[k] = (dtype, arr.ndim)
+  return schema
+
+
+def make_tfexample_writer(schema):
+  """Returns a function that converts examples with a fixed schema to protos.
+
+  The returned function is generated specifically for `schema`, with one
+  statement per feature that appends the values directly into a single
+  tf.train.Example proto. Unlike `dict_to_tfexample`, there is no per-example
+  type dispatch and no intermediate tf.train.Feature objects are constructed.
+  Examples whose keys or value types do not match `schema` raise a ValueError.
+
+  Args:
+    schema: dict mapping feature keys to (dtype, rank) tuples, where dtype is a
+      tf.DType (or anything accepted by `tf.as_dtype`) and rank is 0 or 1.
+
+  Returns:
+    A function that takes an example dictionary with exactly the keys in
+    `schema` and returns a tf.train.Example proto.
+  """
+  lines = [
+      "def tfexample_writer(ex):",
+      "  if ex.keys() != keys:",
+      "    raise ValueError(",
+      "        'Example keys %s do not match the schema keys %s.' %",
+      "        (sorted(ex), sorted(keys)))",
+      "  example = Example()",
+      "  feature = example.features.feature",
+      "  try:",
+  ]
+  for k, (dtype, rank) in schema.items():
+    dtype = tf.as_dtype(dtype)
+    if rank not in (0, 1):
+      raise ValueError("Unsupported rank (%s) for '%s'." % (rank, k))
+    value = "ex[%r]" % k
+    if rank == 0:
+      value = "[%s]" % value
+    elif dtype == tf.string:
+      # Iterating a single string would split it into characters.
+      lines.extend([
+          "    if isinstance(%s, (str, bytes)):" % value,
+          "      raise TypeError(%r)" % (
+              "expected a sequence of strings for '%s'" % k),
+      ])
+    if dtype == tf.string:
+      list_name, value = "bytes_list", "map(as_bytes, %s)" % value
+    elif dtype.is_integer:
+      list_name = "int64_list"
+    elif dtype.is_floating:
+      list_name = "float_list"
+    else:
+      raise ValueError("Unsupported type (%s) for '%s'." % (dtype, k))
+    lines.append("    feature[%r].%s.value.extend(%s)" % (k, list_name, value))
+  lines.extend([
+      "  except TypeError as e:",
+      "    raise ValueError(",
+      "        'Example does not match the schema: %s' % e) from e",
+      "  return example",
+  ])
 
-  return tf.train.Example(features=tf.train.Features(feature=feature_dict))
+  namespace = {
+      "Example": _Example,
+      "as_bytes": tf.compat.as_bytes,
+      "keys": frozenset(schema),
+  }
+  exec("\n".join(lines), namespace)  # pylint:disable=exec-used
+  return namespace["tfexample_writer"]
+
+
+def make_example_serializer(schema):
+  """Returns a function that serializes examples with a fixed schema.
+
+  See `make_tfexample_writer` for details.
+
+  Args:
+    schema: dict mapping feature keys to (dtype, rank) tuples, where dtype is a
+      tf.DType (or anything accepted by `tf.as_dtype`) and rank is 0 or 1.
+
+  Returns:
+    A function that takes an example dictionary with exactly the keys in
+    `schema` and returns the serialized tf.train.Example proto as bytes.
+  """
+  write = make_tfexample_writer(schema)
+  def serialize(ex):
+    return write(ex).SerializeToString()
+  return serialize
+
+
+def dicts_to_serialized_examples(examples, schema):
+  """Returns serialized tf.train.Example protos for examples with a schema."""
+  serialize = make_example_serializer(schema)
+  return [serialize(ex) for ex in examples]
 
 
 # ================================ Tasks =======================================
@@ -207,14 +462,62 @@ def get_tfrecord_prefix(data_dir, split):
   return os.path.join(data_dir, _TFRECORD_PREFIX.format(split=split))
 
 
+def get_tfrecord_shard_path(data_dir, split, shard, num_shards):
+  """Returns the path of a single shard of a sharded TFRecord split."""
+  return get_tfrecord_prefix(data_dir, split) + _TFRECORD_SHARD_SUFFIX.format(
+      shard="%05d" % shard, num_shards=num_shards)
+
+
+def get_tfrecord_sharded_pattern(data_dir, split, num_shards):
+  """Returns a glob pattern matching all shards of a sharded TFRecord split."""
+  return get_tfrecord_prefix(data_dir, split) + _TFRECORD_SHARD_SUFFIX.format(
+      shard="*", num_shards=num_shards)
+
+
+def write_sharded_tfrecords(examples, data_dir, split, num_shards, schema=None):
+  """Writes examples to a sharded TFRecord file of tf.Example protos.
+
+  Examples are assigned to the shards round-robin, so the shards can be read in
+  parallel (e.g., with `tf.data.Dataset.interleave`).
+
+  Args:
+    examples: iterable of example dictionaries.
+    data_dir: str, the directory to write the shards to.
+    split: str, the name of the split, used to name the shards.
+    num_shards: int, the number of shards to write.
+    schema: dict (optional), the `make_example_serializer` schema of the
+      examples. If None, it is inferred from the first example. A ValueError
+      is raised for examples that do not match the schema.
+  Returns:
+    list of the paths of the written shards.
+  """
+  if num_shards < 1:
+    raise ValueError("`num_shards` must be positive, got %d." % num_shards)
+  paths = [
+      get_tfrecord_shard_path(data_dir, split, i, num_shards)
+      for i in range(num_shards)]
+  writers = [tf.io.TFRecordWriter(path) for path in paths]
+  serialize = None if schema is None else make_example_serializer(schema)
+  try:
+    for i, ex in enumerate(examples):
+      if serialize is None:
+        serialize = make_example_serializer(infer_example_schema(ex))
+      writers[i % num_shards].write(serialize(ex))
+  finally:
+    for writer in writers:
+      writer.close()
+  return paths
+
+
 def get_stats_path(data_dir, split):
   return os.path.join(data_dir, _STATS_FILENAME.format(split=split))
 
 
 def print_dataset(dataset):
-  """tf.Print dataset fields for debugging purposes."""
+  """tf.print dataset fields for debugging purposes."""
   def my_fn(x):
-    return {k: tf.Print(v, [v], k + ": ") for k, v in x.items()}
+    tf.print(x)
+    return x
   return dataset.map(my_fn)
 
 
@@ -252,13 +555,29 @@ def rate_unsupervised(task, value=1e6):
 
 
 def stateless_shuffle(value, seed):
-  """Randomly shuffles a tensor, statelessly."""
+  """Randomly shuffles a tensor, statelessly.
+
+  Uses the native `tf.random.experimental.stateless_shuffle` kernel when it is
+  available and otherwise falls back to sorting random scores. Note that the
+  two implementations produce different permutations for the same seed.
+
+  Args:
+    value: a Tensor of any shape.
+    seed: a pair of int32, the stateless random seed.
+  Returns:
+    a Tensor with the same shape and dtype as `value`.
+  """
+  orig_shape = tf.shape(value)
   flat_value = tf.reshape(value, [-1])
-  indices = tf.argsort(
-      tf.random.stateless_uniform(tf.shape(flat_value), seed=seed)
-  )
-  flat_shuffle = tf.gather(flat_value, indices)
-  return tf.reshape(flat_shuffle, tf.shape(value))
+  if _HAS_NATIVE_STATELESS_SHUFFLE:
+    flat_shuffle = tf.random.experimental.stateless_shuffle(
+        flat_value, seed=seed)
+  else:
+    n = tf.shape(flat_value)[0]
+    # `tf.argsort` on floats already lowers to `tf.math.top_k`.
+    indices = tf.argsort(tf.random.stateless_uniform([n], seed=seed))
+    flat_shuffle = tf.gather(flat_value, indices)
+  return tf.reshape(flat_shuffle, orig_shape)
 
 
 # ======================== Decorators =========================================
@@ -267,9 +586,31 @@ def stateless_shuffle(value, seed):
 _NEXT_MAP_SEED = None
 
 
+def _update_wrapper(wrapper, wrapped):
+  """Like `functools.update_wrapper`, but skips `__dict__` and annotations."""
+  wrapper.__module__ = wrapped.__module__
+  wrapper.__name__ = wrapped.__name__
+  wrapper.__qualname__ = wrapped.__qualname__
+  wrapper.__doc__ = wrapped.__doc__
+  wrapper.__wrapped__ = wrapped
+  return wrapper
+
+
 @contextlib.contextmanager
 def map_seed_manager(initial_seed=None):
-  """Contextmanager to control the initial seed used by `map_over_dataset`."""
+  """Contextmanager to control the initial seed used by `map_over_dataset`.
+
+  Fixing the initial seed makes seeded preprocessing deterministic for a given
+  TF version. Outputs may still differ across TF versions, since
+  `stateless_shuffle` uses the native shuffle kernel where it is available and
+  it produces different permutations than the argsort fallback.
+
+  Args:
+    initial_seed: int (optional), the initial seed to use.
+
+  Yields:
+    None.
+  """
   global _NEXT_MAP_SEED
   old_map_seed = _NEXT_MAP_SEED
   _NEXT_MAP_SEED = initial_seed
@@ -277,7 +618,8 @@ def map_seed_manager(initial_seed=None):
   _NEXT_MAP_SEED = old_map_seed
 
 
-def map_over_dataset(fn=None, *, num_seeds=None):
+def map_over_dataset(fn=None, *, num_seeds=None, vectorized=False,
+                     batch_size=256, num_parallel_calls=None):
   """Decorator to map decorated function over dataset.
 
   Many preprocessors map a function over a dataset. This decorator helps reduce
@@ -287,52 +629,87 @@ def map_over_dataset(fn=None, *, num_seeds=None):
   passed to the mapping function with keyword 'seed'.
   If `num_seeds` is greater than 1, unique random seeds (pairs of int32) will be
   passed to the mapping function with keyword 'seeds'.
-  These seeds can be generated deterministically by using the `map_seed_manager`
-  to set the seed for the process that generates the individual seeds for each
-  mapping function. These seeds will be set sequentially from the initial seed
-  for each call to `map_over_dataset` where `num_seeds > 0`.
+  The seeds are generated in the graph from a base seed and the index of each
+  example. They can be made deterministic by using the `map_seed_manager` to
+  set the initial base seed, which is then incremented for each call to
+  `map_over_dataset` where `num_seeds > 0`.
+
+  If `vectorized` is True, the dataset is batched before mapping and unbatched
+  afterwards, so the mapping function is called once per batch of up to
+  `batch_size` examples instead of once per example. The function must then
+  accept (and return) features with a leading batch dimension, and the features
+  must have shapes that can be batched. Any seeds passed to the function also
+  have a leading batch dimension, with one seed per example in the batch.
 
   Args:
     fn: map function
     num_seeds: optional number of random seeds (pairs of int32) to pass to the
       mapping function.
+    vectorized: bool, whether to map the function over batches of examples.
+    batch_size: int, the number of examples per batch when `vectorized` is
+      True.
+    num_parallel_calls: optional number of elements to map in parallel, or None
+      to let tf.data autotune it. A fixed value (e.g., `os.cpu_count()`) avoids
+      the autotuner's warmup for pure-TF functions in short-lived pipelines.
+      Also used to build batches in parallel when `vectorized` is True.
 
   Returns:
     Function which takes dataset as first argument.
   """
 
+  if num_parallel_calls is None:
+    num_parallel_calls = _AUTOTUNE
+
+  def _map(ds, map_fn):
+    if vectorized:
+      return ds.batch(batch_size, num_parallel_calls=num_parallel_calls).map(
+          map_fn, num_parallel_calls=num_parallel_calls).unbatch()
+    return ds.map(map_fn, num_parallel_calls=num_parallel_calls)
+
   def map_without_seeds(fn):
-    @functools.wraps(fn)
     def wrapped_fn(ds, *args, **kargs):
-      return ds.map(
-          lambda arg: fn(arg, *args, **kargs),
-          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+      return _map(ds, lambda arg: fn(arg, *args, **kargs))
 
-    return wrapped_fn
+    return _update_wrapper(wrapped_fn, fn)
 
   def map_with_seeds(fn):
-    @functools.wraps(fn)
     def wrapped_fn(ds, *args, **kwargs):
       global _NEXT_MAP_SEED
       if _NEXT_MAP_SEED is None:
-        random_ds_seeds = ((None, None),) * num_seeds
+        # Fall back to the global seed (if set) like tf.random ops do.
+        base_seed = tf.compat.v1.get_seed(None)
+        if base_seed[0] is None:
+          base_seed = (np.random.randint(np.iinfo(np.int32).max), 0)
       else:
-        random_ds_seeds = np.arange(
-            _NEXT_MAP_SEED, _NEXT_MAP_SEED + 2 * num_seeds).reshape(-1, 2)
-        random_ds_seeds = tuple(tuple(s) for s in random_ds_seeds)
-        _NEXT_MAP_SEED += 2 * num_seeds
-      seed_datasets = tf.nest.map_structure(
-          tf.data.experimental.RandomDataset,
-          random_ds_seeds)
+        base_seed = (_NEXT_MAP_SEED, 0)
+        _NEXT_MAP_SEED += 1
+
+      def get_seeds(i):
+        """Returns `num_seeds` unique seeds for the example with index `i`."""
+        return tf.random.experimental.stateless_split(
+            tf.random.experimental.stateless_fold_in(
+                tf.constant(base_seed, tf.int64), i),
+            num=num_seeds)
+
+      # The indexing below supports seeds with and without a batch dimension.
       if num_seeds == 1:
-        map_fn = lambda x, s: fn(x, seed=s[0], *args, **kwargs)
+        call_fn = lambda x, s: fn(x, seed=s[..., 0, :], *args, **kwargs)
+      else:
+        call_fn = lambda x, s: fn(x, seeds=s, *args, **kwargs)
+
+      ds = ds.enumerate()
+      if vectorized:
+        # Seeds are generated per example index within each batch, so they
+        # match the unvectorized path.
+        map_fn = lambda i, x: call_fn(
+            x, tf.map_fn(get_seeds, i, fn_output_signature=tf.int64))
       else:
-        map_fn = lambda x, s: fn(x, seeds=s, *args, **kwargs)
-      return tf.data.Dataset.zip((ds, seed_datasets)).map(
-          map_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        map_fn = lambda i, x: call_fn(x, get_seeds(i))
+      return _map(ds, map_fn)
 
+    _update_wrapper(wrapped_fn, fn)
     # Remove seeds from function signature.
-    sig = inspect.signature(wrapped_fn)
+    sig = inspect.signature(fn)
     wrapped_fn.__signature__ = sig.replace(
         parameters=tuple(
             p for p in sig.parameters.values() if p.name not in("seed", "seeds")
@@ -340,7 +717,9 @@ def map_over_dataset(fn=None, *, num_seeds=None):
     )
     return wrapped_fn
 
-  if fn is None:
+  if fn is not None:
+    return map_without_seeds(fn)
+  elif num_seeds:
     return map_with_seeds
   else:
-    return map_without_seeds(fn)
+    return map_without_seeds
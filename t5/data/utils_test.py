@@ -14,6 +14,9 @@
 
 # Lint as: python3
 """Tests for t5.data.utils."""
+
+import os
+
 from absl.testing import absltest
 import numpy as np
 from t5.data import utils
@@ -34,7 +37,7 @@ class AnyArg(object):
 class LazyTfdsLoaderTest(absltest.TestCase):
 
   def setUp(self):
-    utils.LazyTfdsLoader._MEMOIZED_BUILDERS = {}
+    utils._get_builder.cache_clear()
     super().setUp()
 
   @mock.patch("tensorflow_datasets.builder")
@@ -75,10 +78,11 @@ class LazyTfdsLoaderTest(absltest.TestCase):
     self.assertEqual("ds2,", ds2.builder)
     self.assertEqual(3, tfds.builder.call_count)
 
+  @mock.patch("tensorflow_datasets.builder")
   @mock.patch("tensorflow_datasets.load")
-  def test_split_map(self, mock_tfds_load):
+  def test_split_map(self, mock_tfds_load, mock_tfds_builder):
     seed = 0
-    utils.LazyTfdsLoader._MEMOIZED_BUILDERS[("ds/c1", None)] = mock.Mock(
+    mock_tfds_builder.return_value = mock.Mock(
         info=mock.Mock(splits={
             "validation": mock.Mock(
                 num_examples=420,
@@ -101,6 +105,29 @@ class LazyTfdsLoaderTest(absltest.TestCase):
         download=True,
         try_gcs=True,
         read_config=AnyArg())
+    mock_tfds_load.return_value.prefetch.assert_called_once_with(
+        tf.data.experimental.AUTOTUNE)
+
+    # test .load() with caching
+    mock_tfds_load.reset_mock()
+    with mock.patch.object(utils.logging, "warning") as mock_warning:
+      ds.load("validation", shuffle_files=False, cache=True)
+      mock_warning.assert_not_called()
+    mock_tfds_load.return_value.cache.assert_called_once_with("")
+
+    mock_tfds_load.reset_mock()
+    with mock.patch.object(utils, "MAX_EXAMPLES_TO_MEM_CACHE", 100), \
+        mock.patch.object(utils.logging, "warning") as mock_warning:
+      ds.load("train", shuffle_files=False, cache=True)
+      mock_warning.assert_called_once()
+      ds.load("train", shuffle_files=False, cache="/tmp/cache")
+      mock_warning.assert_called_once()
+    mock_tfds_load.return_value.cache.assert_called_with("/tmp/cache")
+
+    mock_tfds_load.reset_mock()
+    with mock.patch.object(utils.logging, "warning") as mock_warning:
+      ds.load("validation", shuffle_files=True, cache="/tmp/cache")
+      mock_warning.assert_called_once()
 
     # test .size()
     self.assertEqual(420, ds.size(split="train"))
@@ -114,6 +141,36 @@ class LazyTfdsLoaderTest(absltest.TestCase):
     with self.assertRaises(KeyError):
       ds.files(split="test")
 
+    # Sizes and files are memoized per split.
+    splits = mock_tfds_builder.return_value.info.splits
+    splits["validation"] = mock.Mock(num_examples=0, file_instructions=[])
+    self.assertEqual(420, ds.size(split="train"))
+    self.assertListEqual(["f1", "f2"], ds.files(split="train"))
+
+  @mock.patch("tensorflow_datasets.builder")
+  def test_load_parallel(self, mock_tfds_builder):
+    features = tfds.features.FeaturesDict({"x": tf.int64})
+    tmp_dir = self.create_tempdir().full_path
+    file_instructions = []
+    for i in range(3):
+      filename = os.path.join(tmp_dir, "train.tfrecord-%05d-of-00003" % i)
+      with tf.io.TFRecordWriter(filename) as writer:
+        for x in range(10 * i, 10 * i + 4):
+          writer.write(features.serialize_example({"x": x}))
+      file_instructions.append({"filename": filename, "skip": 1, "take": -1})
+
+    mock_tfds_builder.return_value = mock.Mock(
+        info=mock.Mock(
+            splits={"train": mock.Mock(file_instructions=file_instructions)},
+            features=features))
+    ds = utils.LazyTfdsLoader("ds/c1")
+
+    loaded_ds = ds.load_parallel(
+        "train", shuffle_files=True, seed=0, cycle_length=2)
+    self.assertCountEqual(
+        [1, 2, 3, 11, 12, 13, 21, 22, 23],
+        [ex["x"] for ex in loaded_ds.as_numpy_iterator()])
+
 
 class UtilsTest(absltest.TestCase):
 
@@ -131,7 +188,147 @@ class UtilsTest(absltest.TestCase):
                      [b"this is a target"])
     self.assertEqual(tfe.features.feature["weight"].float_list.value, [5.0])
 
+  def test_dict_to_tfexample_sequences(self):
+    tfe = utils.dict_to_tfexample({
+        "inputs": np.array([1, 2, 3], np.int32),
+        "tokens": [b"a", "b"],
+        "raw": [b"c\x00", b"d"],
+        "text": ["c\x00", "d"],
+        "char": "c\x00",
+        "scores": np.array([0.5, 1.5], np.float32),
+    })
+
+    self.assertEqual(tfe.features.feature["inputs"].int64_list.value,
+                     [1, 2, 3])
+    self.assertEqual(tfe.features.feature["tokens"].bytes_list.value,
+                     [b"a", b"b"])
+    self.assertEqual(tfe.features.feature["raw"].bytes_list.value,
+                     [b"c\x00", b"d"])
+    self.assertEqual(tfe.features.feature["text"].bytes_list.value,
+                     [b"c\x00", b"d"])
+    self.assertEqual(tfe.features.feature["char"].bytes_list.value,
+                     [b"c\x00"])
+    self.assertEqual(tfe.features.feature["scores"].float_list.value,
+                     [0.5, 1.5])
+
+    with self.assertRaisesRegex(ValueError, "Unsupported shape"):
+      utils.dict_to_tfexample({"inputs": np.zeros((2, 2), np.int32)})
+    with self.assertRaisesRegex(ValueError, "Unsupported mixed types"):
+      utils.dict_to_tfexample({"inputs": [1, "a"]})
+    with self.assertRaisesRegex(ValueError, "Unsupported mixed types"):
+      utils.dict_to_tfexample({"inputs": [1, b"a"]})
+
+  def test_dict_to_tfexample_pack_int32_as_bytes(self):
+    tfe = utils.dict_to_tfexample({
+        "inputs": np.array([1, 2, 2**31 - 1], np.int64),
+        "targets": [4, 5],
+    }, pack_int32_as_bytes={"inputs"})
+
+    self.assertEmpty(tfe.features.feature["inputs"].int64_list.value)
+    self.assertEqual(tfe.features.feature["targets"].int64_list.value, [4, 5])
+
+    parsed = tf.io.parse_single_example(
+        tfe.SerializeToString(),
+        {"inputs": tf.io.FixedLenFeature([], tf.string)})
+    np.testing.assert_array_equal(
+        utils.decode_packed_int32(parsed["inputs"]), [1, 2, 2**31 - 1])
+
+    tfe = utils.dict_to_tfexample(
+        {"inputs": []}, pack_int32_as_bytes={"inputs"})
+    self.assertEqual(tfe.features.feature["inputs"].bytes_list.value, [b""])
+
+    with self.assertRaisesRegex(ValueError, "Unable to pack"):
+      utils.dict_to_tfexample(
+          {"inputs": [2**31]}, pack_int32_as_bytes={"inputs"})
+    with self.assertRaisesRegex(ValueError, "Unable to pack"):
+      utils.dict_to_tfexample(
+          {"inputs": "a string"}, pack_int32_as_bytes={"inputs"})
+
+  def test_make_example_serializer(self):
+    ex = {
+        "inputs": np.array([1, 2, 3], np.int32),
+        "targets": "this is a target",
+        "weight": 5.0,
+    }
+    schema = utils.infer_example_schema(ex)
+    self.assertDictEqual(
+        {"inputs": (tf.int64, 1), "targets": (tf.string, 0),
+         "weight": (tf.float32, 0)},
+        schema)
+
+    serialized = utils.dicts_to_serialized_examples([ex, ex], schema)
+    self.assertLen(serialized, 2)
+    self.assertEqual(
+        utils.dict_to_tfexample(ex),
+        tf.train.Example.FromString(serialized[0]))
+
+    with self.assertRaisesRegex(ValueError, "Unsupported rank"):
+      utils.make_example_serializer({"inputs": (tf.int32, 2)})
+    with self.assertRaisesRegex(ValueError, "Unsupported type"):
+      utils.make_example_serializer({"inputs": (tf.bool, 1)})
+
+  def test_make_tfexample_writer(self):
+    ex = {
+        "inputs": [1, 2, 3],
+        "targets": b"this is a target",
+        "ids": ["a", "b"],
+        "weight's": np.float32(5.0),
+    }
+    write = utils.make_tfexample_writer({
+        "inputs": (tf.int32, 1),
+        "targets": (tf.string, 0),
+        "ids": (tf.string, 1),
+        "weight's": (tf.float32, 0),
+    })
+    self.assertEqual(utils.dict_to_tfexample(ex), write(ex))
+
+    with self.assertRaisesRegex(ValueError, "do not match the schema keys"):
+      write({"inputs": [1]})
+    with self.assertRaisesRegex(ValueError, "do not match the schema keys"):
+      write(dict(ex, extra=1))
+    with self.assertRaisesRegex(ValueError, "does not match the schema"):
+      write(dict(ex, inputs=[1.5]))
+    with self.assertRaisesRegex(ValueError, "expected a sequence of strings"):
+      write(dict(ex, ids="ab"))
+
+  def test_write_sharded_tfrecords(self):
+    data_dir = self.create_tempdir().full_path
+    examples = [{"idx": i, "text": "example %d" % i} for i in range(5)]
+    paths = utils.write_sharded_tfrecords(examples, data_dir, "train", 2)
+
+    self.assertEqual(
+        [utils.get_tfrecord_shard_path(data_dir, "train", i, 2)
+         for i in range(2)],
+        paths)
+    self.assertTrue(paths[0].endswith("train.tfrecord-00000-of-00002"))
+    self.assertCountEqual(
+        paths,
+        tf.io.gfile.glob(
+            utils.get_tfrecord_sharded_pattern(data_dir, "train", 2)))
+
+    def _read_idxs(path):
+      return [
+          tf.train.Example.FromString(ex).features.feature["idx"]
+          .int64_list.value[0]
+          for ex in tf.data.TFRecordDataset(path).as_numpy_iterator()]
+    self.assertEqual([0, 2, 4], _read_idxs(paths[0]))
+    self.assertEqual([1, 3], _read_idxs(paths[1]))
+
+    with self.assertRaisesRegex(ValueError, "must be positive"):
+      utils.write_sharded_tfrecords(examples, data_dir, "train", 0)
+
   def test_stateless_shuffle(self):
+    value = np.arange(6)
+    shuffled_1 = utils.stateless_shuffle(value, (0, 1))
+    np.testing.assert_array_equal(np.sort(shuffled_1), value)
+    np.testing.assert_array_equal(
+        utils.stateless_shuffle(value, (0, 1)), shuffled_1)
+    np.testing.assert_array_equal(
+        utils.stateless_shuffle(value.reshape((2, 3)), (0, 1)),
+        np.reshape(shuffled_1, (2, 3)))
+
+  @mock.patch.object(utils, "_HAS_NATIVE_STATELESS_SHUFFLE", False)
+  def test_stateless_shuffle_argsort(self):
     value = np.arange(6)
     expected_output_1 = np.array([0, 3, 4, 2, 1, 5])
     expected_output_2 = np.array([3, 4, 0, 2, 5, 1])
@@ -154,6 +351,30 @@ class UtilsTest(absltest.TestCase):
 
     self.assertEqual(list(test_fn(inputs).as_numpy_iterator()), [1, 2, 3, 4, 5])
 
+  def test_map_over_dataset_num_parallel_calls(self):
+    inputs = tf.data.Dataset.range(5)
+
+    @utils.map_over_dataset(num_parallel_calls=2)
+    def test_fn(x):
+      return x + 1
+
+    with mock.patch.object(
+        tf.data.Dataset, "map", autospec=True,
+        side_effect=tf.data.Dataset.map) as mock_map:
+      outputs = test_fn(inputs)
+      mock_map.assert_called_once_with(inputs, AnyArg(), num_parallel_calls=2)
+    self.assertEqual(list(outputs.as_numpy_iterator()), [1, 2, 3, 4, 5])
+
+  def test_map_over_dataset_vectorized(self):
+    inputs = tf.data.Dataset.range(5)
+
+    @utils.map_over_dataset(vectorized=True, batch_size=2)
+    def test_fn(x):
+      tf.debugging.assert_rank(x, 1)
+      return x + 1
+
+    self.assertEqual(list(test_fn(inputs).as_numpy_iterator()), [1, 2, 3, 4, 5])
+
   # We disable no-value-for-parameter since the utils.map_over_dataset leads to
   # a false positive when seeds are provided.
   # pylint:disable=no-value-for-parameter
@@ -167,8 +388,8 @@ class UtilsTest(absltest.TestCase):
       return x + seed
 
     expected = [
-        np.array([2985944072, 3810604164]),
-        np.array([4132877645, 4228622226])
+        np.array([-2260153359756547245, -4257992252322182123]),
+        np.array([-8051593648476479876, -7615679941904107853])
     ]
     for exp, act in zip(expected, test_fn(inputs).as_numpy_iterator()):
       np.testing.assert_array_equal(exp, act)
@@ -182,12 +403,46 @@ class UtilsTest(absltest.TestCase):
       return x + seeds
 
     expected = [
-        np.array([[2985944072, 3810604164], [64669036, 3548694723]]),
-        np.array([[4132877645, 4228622226], [2495033825, 798765318]])
+        np.array([[-2260153359756547245, -4257992252322182123],
+                  [526260078800936085, 5808548249808378561]]),
+        np.array([[-8051593648476479876, -7615679941904107853],
+                  [7515153376335736610, 6458042310712416414]])
+    ]
+    for exp, act in zip(expected, test_fn(inputs).as_numpy_iterator()):
+      np.testing.assert_array_equal(exp, act)
+
+  def test_map_over_dataset_vectorized_with_one_seed(self):
+    inputs = tf.data.Dataset.range(2)
+
+    utils._NEXT_MAP_SEED = 42
+    @utils.map_over_dataset(num_seeds=1, vectorized=True, batch_size=2)
+    def test_fn(x, seed):
+      return x[:, tf.newaxis] + seed
+
+    expected = [
+        np.array([-2260153359756547245, -4257992252322182123]),
+        np.array([-8051593648476479876, -7615679941904107853])
     ]
     for exp, act in zip(expected, test_fn(inputs).as_numpy_iterator()):
       np.testing.assert_array_equal(exp, act)
 
+  def test_map_over_dataset_vectorized_with_seeds(self):
+    inputs = tf.data.Dataset.range(5)
+
+    def seeds_fn(x, seeds):
+      del x
+      return seeds
+
+    with utils.map_seed_manager(42):
+      expected = list(utils.map_over_dataset(num_seeds=2)(seeds_fn)(
+          inputs).as_numpy_iterator())
+    with utils.map_seed_manager(42):
+      # The last batch is partial.
+      actual = list(utils.map_over_dataset(
+          num_seeds=2, vectorized=True, batch_size=2)(seeds_fn)(
+              inputs).as_numpy_iterator())
+    np.testing.assert_array_equal(expected, actual)
+
   # pylint:enable=no-value-for-parameter
 
   def test_map_seed_manager(self):